@@ -0,0 +1,70 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from .interpreter import Interpreter
+
+
+class AsyncInterpreter:
+    """
+    Run Shetland scripts from asyncio code without blocking the event
+    loop. Each script runs in a thread from a bounded pool with its own
+    Interpreter, so scripts don't share variables, the current datasource
+    or configuration options set with set. The block cache is shared by
+    the whole process so scripts can't set cache, and they can't use the
+    readline history.
+    """
+
+    def __init__(self, file="shetland.g", max_workers=None):
+        self.file = file
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.shutdown()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def __run(self, program, emit):
+        """
+        Parse and run program in a worker thread, passing everything it
+        prints and the result of each command to emit
+        """
+        def output(*args, sep=" ", **kwargs):
+            emit("print", sep.join(str(a) for a in args))
+
+        interpreter = Interpreter(self.file, interactive=False,
+                                  output=output)
+        interpreter.local_config = True
+        try:
+            parse_tree = interpreter.parse(program)
+            for inst in parse_tree.children:
+                emit("result", interpreter.run_instruction(inst))
+        finally:
+            interpreter.close()
+
+    async def run(self, program):
+        """
+        Run the command(s) in program, yielding ("print", text) for each
+        line printed and ("result", value) as each command finishes. Any
+        exception raised by the script is raised once its output has been
+        yielded. Datasources returned as results (e.g. by open) are not
+        closed when the script ends, they stay open until the caller drops
+        them.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def emit(kind, value):
+            loop.call_soon_threadsafe(queue.put_nowait, (kind, value))
+
+        future = loop.run_in_executor(self.executor, self.__run, program,
+                                      emit)
+        future.add_done_callback(lambda f: queue.put_nowait(None))
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            yield item
+        await future
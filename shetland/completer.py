@@ -1,15 +1,184 @@
+import os
+import time
+
+
+class Trie:
+    """
+    A prefix tree of words. Words can be added and removed one at a time
+    and the words starting with a prefix are found without scanning the
+    whole vocabulary. Each word is counted so that it can be added from
+    more than one place and is only removed when the last copy goes.
+    """
+    END = ""  # key marking the end of a word, never a character
+
+    def __init__(self, words=()):
+        self.root = {}
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        node = self.root
+        for c in word:
+            node = node.setdefault(c, {})
+        node[self.END] = node.get(self.END, 0) + 1
+
+    def remove(self, word):
+        path = []
+        node = self.root
+        for c in word:
+            if c not in node:
+                return
+            path.append((node, c))
+            node = node[c]
+        if self.END not in node:
+            return
+        node[self.END] -= 1
+        if node[self.END] > 0:
+            return
+        del node[self.END]
+        # prune the branches that no longer lead to a word
+        for parent, c in reversed(path):
+            if parent[c]:
+                break
+            del parent[c]
+
+    def __contains__(self, word):
+        node = self.__find(word)
+        return node is not None and self.END in node
+
+    def __find(self, prefix):
+        node = self.root
+        for c in prefix:
+            node = node.get(c)
+            if node is None:
+                return None
+        return node
+
+    def startswith(self, prefix):
+        """
+        Return a sorted list of the words that start with prefix
+        """
+        node = self.__find(prefix)
+        if node is None:
+            return []
+        words = []
+        stack = [(node, prefix)]
+        while stack:
+            node, word = stack.pop()
+            if self.END in node:
+                words.append(word)
+            stack.extend((child, word + c) for c, child in node.items()
+                         if c != self.END)
+        return sorted(words)
+
+
 class Completer:
+    """
+    Readline completer for keywords, variables, layer names and file
+    paths. Keywords, variables and layers are kept in a single Trie that
+    the interpreter updates as things change, the layer names of a
+    datasource and the contents of directories are cached so that they
+    are only read again when the file or directory changes.
+    """
+    # seconds before a directory is checked for changes
+    cache_timeout = 10
+
     def __init__(self, words):
-        self.words = words
+        self.words = Trie(words)
+        self.prefix = None
+        self.matching_words = []
+        self.layers = {}  # filename -> (mtime, layer names)
+        self.sources = {}  # filename -> number of times it is open
+        self.directories = {}  # directory -> (checked, mtime, Trie)
+
+    def add_word(self, word):
+        self.words.add(word)
         self.prefix = None
 
+    def remove_word(self, word):
+        self.words.remove(word)
+        self.prefix = None
+
+    def add_source(self, filename, names):
+        """
+        Add the layer names of an open datasource. names is a function
+        returning the names, it is only called if the file has changed
+        since it was last seen.
+        """
+        mtime = self.__mtime(filename)
+        cached = self.layers.get(filename)
+        if cached is None or cached[0] != mtime:
+            new = list(names())
+            # swap the names for any copies that are already open
+            for _ in range(self.sources.get(filename, 0)):
+                for name in cached[1]:
+                    self.words.remove(name)
+                for name in new:
+                    self.words.add(name)
+            cached = self.layers[filename] = (mtime, new)
+        for name in cached[1]:
+            self.words.add(name)
+        self.sources[filename] = self.sources.get(filename, 0) + 1
+        self.prefix = None
+
+    def remove_source(self, filename):
+        """
+        Remove the layer names of a datasource that has been closed, they
+        stay cached for when it is opened again.
+        """
+        if not self.sources.get(filename):
+            return
+        self.sources[filename] -= 1
+        for name in self.layers[filename][1]:
+            self.words.remove(name)
+        self.prefix = None
+
+    @staticmethod
+    def __mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def __listdir(self, directory):
+        """
+        Return a Trie of the entries in directory (with a trailing / on
+        subdirectories), from the cache if it is still fresh
+        """
+        now = time.monotonic()
+        cached = self.directories.get(directory)
+        if cached is not None and now - cached[0] < self.cache_timeout:
+            return cached[2]
+        mtime = self.__mtime(directory or ".")
+        if cached is not None and cached[1] == mtime:
+            self.directories[directory] = (now, mtime, cached[2])
+            return cached[2]
+        entries = Trie()
+        try:
+            with os.scandir(directory or ".") as it:
+                for entry in it:
+                    entries.add(entry.name + "/" if entry.is_dir()
+                                else entry.name)
+        except OSError:
+            pass
+        self.directories[directory] = (now, mtime, entries)
+        return entries
+
+    def paths(self, prefix):
+        """
+        Return the files and directories that start with prefix
+        """
+        directory, name = os.path.split(os.path.expanduser(prefix))
+        head = prefix[:len(prefix) - len(name)]
+        return [head + entry
+                for entry in self.__listdir(directory).startswith(name)]
+
     def complete(self, prefix, index):
         if prefix != self.prefix:
             # we have a new prefix!
-            # find all words that start with this prefix
-            self.matching_words = [
-                w for w in self.words if w.startswith(prefix)
-                ]
+            # find all words and files that start with this prefix
+            self.matching_words = self.words.startswith(prefix)
+            self.matching_words += self.paths(prefix)
             self.prefix = prefix
         try:
             return self.matching_words[index]
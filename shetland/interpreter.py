@@ -2,10 +2,16 @@ import os
 from pathlib import Path
 import readline
 import atexit
+import random
+import struct
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from .completer import Completer
 from lark import Lark, UnexpectedInput
-from lark.lexer import Token
+from lark.lexer import Token, PatternStr
 from lark.tree import Tree
+import numpy as np
 from osgeo import ogr, gdal
 
 
@@ -16,20 +22,70 @@ class Interpreter:
         "json": "GeoJSON",
         "geojson": "GeoJSON",
     }
-    vars = {}
     history_file = os.path.join(os.path.expanduser('~'), ".shetland_hist")
     history_length = 1000
+    # features are read and simplified in batches of this size, spread
+    # over this many worker threads
+    batch_size = 1000
+    workers = os.cpu_count()
+    # default number of features shown by head, and the seed used by
+    # sample so that samples are reproducible
+    head_length = 10
+    sample_seed = 1
+    # short names for the GDAL configuration options used with set
+    config_options = {
+        "cache": "GDAL_CACHEMAX",
+        "threads": "GDAL_NUM_THREADS",
+        "sqlite_cache": "OGR_SQLITE_CACHE",
+        "sync": "OGR_SQLITE_SYNCHRONOUS",
+    }
+    # set configuration options for the calling thread only, so that
+    # interpreters running in different threads don't see each other's
+    local_config = False
+
+    # parsers, and a cache of the trees they have parsed keyed by the
+    # program text, are shared by all the interpreters using the same grammar
+    parsers = {}
+    parse_caches = {}
+    parse_cache_size = 256
+    # commands whose arguments are names rather than values
+    unbound = ('close', 'set')
 
-    def __init__(self, file="shetland.g"):
+    def __init__(self, file="shetland.g", interactive=True, output=print):
+        """
+        Create an interpreter for the grammar in file. Only interactive
+        interpreters use the readline history and completion, output is
+        called like print with everything the commands print.
+        """
         __location__ = os.path.realpath(
             os.path.join(os.getcwd(), os.path.dirname(__file__)))
-        with open(os.path.join(__location__, file)) as f:
-            grammar = f.read()
+        path = os.path.join(__location__, file)
+        if path not in self.parsers:
+            with open(path) as f:
+                grammar = f.read()
+            self.parsers[path] = Lark(grammar)
+            self.parse_caches[path] = lru_cache(
+                maxsize=self.parse_cache_size)(self.parsers[path].parse)
 
-        self.parser = Lark(grammar)
+        self.parser = self.parsers[path]
+        self.parse = self.parse_caches[path]
+        self.output = output
+        # variables live in a chain of scopes, the global scope is the last
+        # map and each for block pushes a new scope on the front
+        self.vars = ChainMap()
+        self.dataSource = None
+        # thread local options set for the session, put back by close
+        self.__savedOptions = {}
         ogr.UseExceptions()
         gdal.UseExceptions()
-        self.__setup()
+        # the keywords are the plain string terminals of the grammar
+        words = set(t.pattern.value for t in self.parser.terminals
+                    if isinstance(t.pattern, PatternStr) and
+                    t.pattern.value.isalpha())
+        self.completer = Completer(words)
+        self.interactive = interactive
+        if interactive:
+            self.__setup()
 
     def __setup(self):
         """
@@ -46,11 +102,8 @@ class Interpreter:
 
         readline.parse_and_bind('set enable-keypad on')
 
-        # TODO find out how to get this list from the grammar
-        words = "open", "save", "list", "info", "history", "layer", "print"
-        completer = Completer(words)
-        readline.set_completer(completer.complete)
-        # readline.set_completer_delims(' \t\n;')
+        readline.set_completer(self.completer.complete)
+        readline.set_completer_delims(' \t\n;=,[]{}"\'')
         readline.parse_and_bind("tab: complete")
 
     def run_instruction(self, t):
@@ -67,6 +120,7 @@ class Interpreter:
                 self.assignVar(args[0].value, args[2:])  # skip =
                 return True
 
+            args = self.bind(args)
             if(len(args) >= 2):  # commands with filename
                 res = {
                     'open': self.ogr_open,
@@ -75,11 +129,17 @@ class Interpreter:
                     'print': self.print_,
                     'list': self.ogr_list,
                     'copy': self.ogr_copy,
+                    'head': self.ogr_head,
+                    'sample': self.ogr_sample,
+                    'close': self.ogr_close,
+                    'set': self.set_option,
                 }[args[0]](*args[1:])
             else:
                 res = {
                     'list': self.ogr_list,
                     'history': self.history,
+                    'close': self.ogr_close,
+                    'memory': self.memory,
                 }[args[0]]()
         elif t.data == 'exec':
             res = self.exec_hist(args[1])
@@ -87,6 +147,8 @@ class Interpreter:
             res = self.exec_hist("last")
         elif t.data == 'for':
             res = self.__do_for(args)
+        elif t.data == 'set_block':
+            res = self.__do_set_block(args)
         elif t.data == 'code_block':
             for cmd in t.children:
                 res = self.run_instruction(cmd)
@@ -94,6 +156,38 @@ class Interpreter:
             raise SyntaxError('Unknown instruction: %s' % t.data)
         return res
 
+    def bind(self, args):
+        """
+        Replace the arguments of a command that name variables with the
+        current values of the variables. Parse trees only ever hold the
+        names so a cached tree can be run again with new values without
+        parsing it again.
+        """
+        if args[0] in self.unbound:
+            return args
+        return [self.__bindArg(arg) for arg in args]
+
+    def __bindArg(self, arg):
+        """
+        Return the value of the variable arg names, or arg itself if it
+        isn't a variable. An undefined VARIABLE is an error.
+        """
+        if isinstance(arg, Token) and arg.type in ('VARIABLE', 'ATOM'):
+            if arg.value in self.vars:
+                return self.vars[arg.value]
+            elif arg.type == 'VARIABLE':
+                raise SyntaxError('Undefined variable %s' % arg.value)
+        return arg
+
+    @staticmethod
+    def __value(arg):
+        """
+        Get the value of a (bound) argument
+        """
+        if isinstance(arg, Token):
+            return arg.value
+        return arg
+
     def assignVar(self, name, vals):
         """
         Assign a value to a variable
@@ -105,10 +199,7 @@ class Interpreter:
             # print("setting "+name+" to "+val)
             if isinstance(val, Token):
                 if val.type == 'VARIABLE':
-                    if val.value in self.vars:
-                        ret = self.vars.get(val.value)
-                    else:
-                        raise SyntaxError('Undefined variable %s' % val.value)
+                    ret = self.__bindArg(val)
                 elif val.type in ('ATOM', 'FILENAME', 'CNAME'):
                     ret = self.__getFileName(val)
             # elif isinstance(val, Tree):
@@ -122,7 +213,118 @@ class Interpreter:
             tree = Tree('command', vals)
             ret = self.run_instruction(tree)
 
+        if name in self.vars.maps[0]:
+            old = self.vars.maps[0][name]
+        else:
+            old = None
+            self.completer.add_word(name)
         self.vars[name] = ret
+        if old is not ret:
+            self.__release(old)
+
+    @staticmethod
+    def __isHandle(value):
+        return isinstance(value, (ogr.DataSource, gdal.Dataset))
+
+    def __release(self, value):
+        """
+        Forget a GDAL handle if nothing else in the interpreter (a variable
+        in any scope or the current datasource) refers to it, returning
+        True if it was forgotten. The handle isn't closed here as the
+        caller of run may still hold it, GDAL closes it once the last
+        reference goes.
+        """
+        if not self.__isHandle(value) or value is self.dataSource:
+            return False
+        for scope in self.vars.maps:
+            if any(v is value for v in scope.values()):
+                return False
+        self.completer.remove_source(value.GetDescription())
+        return True
+
+    def __pushScope(self):
+        self.vars = self.vars.new_child()
+
+    def __popScope(self):
+        """
+        Drop the innermost scope, forgetting any handles that were only
+        referenced from it
+        """
+        scope = self.vars.maps[0]
+        self.vars = self.vars.parents
+        for name, value in scope.items():
+            self.completer.remove_word(name)
+            self.__release(value)
+
+    def ogr_close(self, arg=None):
+        """
+        Close the datasource held in a variable and forget the variable,
+        or with no variable close the current datasource
+        """
+        if arg is None:
+            value = self.dataSource
+        else:
+            for scope in self.vars.maps:
+                if arg.value in scope:
+                    value = scope.pop(arg.value)
+                    self.completer.remove_word(arg.value)
+                    break
+            else:
+                raise SyntaxError('Undefined variable %s' % arg.value)
+        if value is self.dataSource:
+            self.dataSource = None
+        if self.__release(value):
+            if hasattr(value, 'Close'):
+                value.Close()
+            else:
+                value.Release()
+        return True
+
+    def close(self):
+        """
+        Forget all the datasources held by this interpreter (they are
+        closed once nothing else refers to them) and put back any thread
+        local configuration options
+        """
+        for option, previous in self.__savedOptions.items():
+            self.__restoreOption(option, previous)
+        self.__savedOptions.clear()
+        while self.vars.maps[1:]:
+            self.__popScope()
+        scope = self.vars.maps[0]
+        values = list(scope.values())
+        for name in scope:
+            self.completer.remove_word(name)
+        scope.clear()
+        current, self.dataSource = self.dataSource, None
+        for value in {id(v): v for v in values + [current]}.values():
+            self.__release(value)
+
+    def memory(self):
+        """
+        Report on the GDAL block cache, the open datasources,
+        (where the OS tells us) the open file descriptors and the parse
+        cache
+        """
+        self.output("Block cache: %d of %d bytes used" %
+                    (gdal.GetCacheUsed(), gdal.GetCacheMax()))
+        handles = {}
+        if self.dataSource is not None:
+            handles[id(self.dataSource)] = [self.dataSource, "(current)"]
+        for depth, scope in enumerate(reversed(self.vars.maps)):
+            for name, value in scope.items():
+                if self.__isHandle(value):
+                    handles.setdefault(id(value), [value]).append(
+                        "%s (scope %d)" % (name, depth))
+        self.output("%d open datasources" % len(handles))
+        for value, *names in handles.values():
+            self.output("%s: %s" % (value.GetDescription(), ", ".join(names)))
+        if os.path.isdir("/proc/self/fd"):
+            self.output("%d open files" % len(os.listdir("/proc/self/fd")))
+        info = self.parse.cache_info()
+        self.output("Parse cache: %d hits, %d misses, %d of %d trees" %
+                    (info.hits, info.misses, info.currsize, info.maxsize))
+        return True
 
     @classmethod
     def getHistoryLength(cls):
@@ -150,16 +352,14 @@ class Interpreter:
             p = Path('.')
             list_ = [Token(value=l, type_="FILENAME")
                      for l in list(p.glob(val))]
-        else:  # just a variable or single file?
-            try:
-                v = self.__getVar(val)
-                if isinstance(v, list):
-                    list_ = v[:]
-                else:
-                    list_.append(Token(type_="VARIABLE",
-                                       value=v))
-            except SyntaxError:
-                list_ = [Token(value=val, type_="CNAME")]
+        elif val in self.vars:  # a variable holding a list or a value
+            v = self.vars[val]
+            if isinstance(v, list):
+                list_ = v[:]
+            else:
+                list_.append(v)
+        else:  # a single file
+            list_ = [Token(value=val, type_="CNAME")]
         # print(list_)
         return list_
 
@@ -173,21 +373,102 @@ class Interpreter:
         list_ = self.__parseList(args[3])
         block = args[4]
         res = False
-        for i in list_:
-            self.assignVar(variable, i)
-            res = self.run_instruction(block)
-            if not res:
-                break
+        self.__pushScope()
+        try:
+            for i in list_:
+                self.assignVar(variable, i)
+                res = self.run_instruction(block)
+                if not res:
+                    break
+        finally:
+            self.__popScope()
         return res
 
-    @classmethod
-    def history(cls):
+    def __setOption(self, name, value):
+        """
+        Set a GDAL configuration option and return the option's name and
+        previous value. The block cache is resized directly as GDAL only
+        reads GDAL_CACHEMAX when the cache is first used.
+        """
+        option = self.config_options.get(name, name)
+        if option == 'GDAL_CACHEMAX':
+            if self.local_config:
+                # the block cache is shared by every thread in the process
+                raise SyntaxError('The block cache size can not be set '
+                                  'from scripts running concurrently')
+            previous = gdal.GetCacheMax()
+            try:
+                size = float(value)
+            except ValueError:
+                raise SyntaxError('Cache size must be a number, not %s' %
+                                  value)
+            if size < 100000:  # MB, as GDAL reads GDAL_CACHEMAX
+                size *= 1024 * 1024
+            gdal.SetCacheMax(int(round(size)))
+        elif self.local_config:
+            previous = gdal.GetThreadLocalConfigOption(option, None)
+            gdal.SetThreadLocalConfigOption(option, str(value))
+        else:
+            previous = gdal.GetConfigOption(option)
+            gdal.SetConfigOption(option, str(value))
+        return option, previous
+
+    def __restoreOption(self, option, previous):
+        if option == 'GDAL_CACHEMAX':
+            gdal.SetCacheMax(previous)
+        elif self.local_config:
+            gdal.SetThreadLocalConfigOption(option, previous)
+        else:
+            gdal.SetConfigOption(option, previous)
+
+    def set_option(self, name, value=None):
+        """
+        Set a GDAL configuration option (or one of the short names in
+        config_options) for the rest of the session, or with no value
+        print the option's current value
+        """
+        if value is None:
+            option = self.config_options.get(name, name)
+            if option == 'GDAL_CACHEMAX':
+                current = gdal.GetCacheMax()
+            else:
+                current = gdal.GetConfigOption(option)
+            self.output("%s=%s" % (option, current))
+            return True
+        option, previous = self.__setOption(name, value)
+        if self.local_config:
+            self.__savedOptions.setdefault(option, previous)
+        return True
+
+    def __do_set_block(self, args):
+        """
+        Set a GDAL configuration option while the attached code block
+        runs and then put it back
+        """
+        option, previous = self.__setOption(args[1], args[2])
+        try:
+            res = self.run_instruction(args[3])
+        finally:
+            self.__restoreOption(option, previous)
+        return res
+
+    def __checkHistory(self):
+        """
+        The readline history is shared by the whole process so only
+        interactive interpreters can use it
+        """
+        if not self.interactive:
+            raise SyntaxError('History is only available in the '
+                              'interactive interpreter')
+
+    def history(self):
         """
         Print out the history file with reference numbers
         """
+        self.__checkHistory()
         length = readline.get_current_history_length()
         for i in range(1, length):
-            print("%d: %s" % (i, readline.get_history_item(i)))
+            self.output("%d: %s" % (i, readline.get_history_item(i)))
         return True
 
     def exec_hist(self, *args):
@@ -197,6 +478,7 @@ class Interpreter:
         execute it.
         TODO: implement '!prefix'
         """
+        self.__checkHistory()
         length = readline.get_current_history_length()
         if(args[0] == "last" and length > 2):
             val = length - 2  # last cmd
@@ -212,66 +494,18 @@ class Interpreter:
 
     def print_(self, *args):
         """
-        Print out the values of a list of tokens - expanding variables if
-        present.
+        Print out the values of a list of (bound) arguments
         """
         for arg in args:
-            if isinstance(arg, Token):
-                if (arg.type == 'VARIABLE'):
-                    var = arg.value
-                    # print("looking up value of "+var)
-                    if var in self.vars:
-                        resp = self.vars.get(var)
-                        if isinstance(resp, Token):
-                            print(resp.value)
-                        else:
-                            print(resp)
-                    else:
-                        raise SyntaxError('Undefined variable %s' % var)
-                else:
-                    print(arg.value)
-            else:
-                print(arg)
+            self.output(self.__value(arg))
         return True
 
-    def __getVar(self, arg):
-        """
-        Look up the variable stored in arg and return it
-        """
-        if isinstance(arg, Token):
-            if arg.value in self.vars:
-                v = self.vars.get(arg.value)
-            else:
-                raise SyntaxError('Undefined variable %s' % arg.value)
-        else:
-            if arg in self.vars:
-                v = self.vars.get(arg)
-                print(v)
-            else:
-                raise SyntaxError('Undefined variable %s' % arg)
-        if isinstance(v, Token):
-            return v.value
-        else:
-            return v
-
     def __getFileName(self, arg):
         """
-        Gets a filename from a token id if it is a variable,
-        strips quotes from
+        Gets a filename from a (bound) argument, strips quotes from
         the result. Uses pathlib to resolve name.
         """
-        if isinstance(arg, Token):
-            if arg.type == 'VARIABLE':
-                if arg.value in self.vars:
-                    filename = self.vars.get(arg.value).value
-                else:
-                    raise SyntaxError('Undefined variable %s' % arg.value)
-            else:
-                filename = arg.value
-        else:
-            filename = arg
-
-        filename = str(filename).strip('"').strip("'")
+        filename = str(self.__value(arg)).strip('"').strip("'")
         p = Path(filename)
         filename = str(p.resolve())
         return filename
@@ -281,30 +515,253 @@ class Interpreter:
         Open a spatial file (with an extension in the drivers dict).
         """
         filename = self.__getFileName(args[0])
-        self.dataSource = ogr.Open(filename, 0)
-        if self.dataSource is None:
+        dataSource = ogr.Open(filename, 0)
+        if dataSource is None:
             raise IOError("Could not open %s" % (filename))
         else:
-            print('Opened %s' % (filename))
+            self.output('Opened %s' % (filename))
+            old, self.dataSource = self.dataSource, dataSource
+            self.completer.add_source(
+                dataSource.GetDescription(),
+                lambda: [dataSource.GetLayerByIndex(i).GetName()
+                         for i in range(dataSource.GetLayerCount())])
+            self.__release(old)
             self.filename = filename
             return self.dataSource
 
-    def is_var(self, arg):
-        return arg in self.vars
+    def __getOptions(self, args):
+        """
+        Split the trailing options (simplify, precision, with options) from
+        the arguments of a copy or save and return them as a dict
+        """
+        options = {}
+        plain = []
+        for arg in args:
+            if isinstance(arg, Tree) and arg.data == 'with_options':
+                options[arg.data] = [c.value for c in arg.children]
+            elif isinstance(arg, Tree):
+                options[arg.data] = arg.children[0].value
+            else:
+                plain.append(arg)
+        return plain, options
+
+    @staticmethod
+    def __hasOption(drv, item, option):
+        """
+        Check if the driver lists the named option in its metadata item
+        (the dataset or layer creation option list)
+        """
+        options = drv.GetMetadataItem(item)
+        return options is not None and ('name="%s"' % option) in options
+
+    def __creationOptions(self, drv, options):
+        """
+        Split the with options of a copy or save into dataset and layer
+        creation options, using the lists the driver publishes. Options
+        the driver doesn't list are passed to the layer.
+        """
+        datasetOptions = []
+        layerOptions = []
+        for option in options.get('with_options', []):
+            name = option.split("=", 1)[0]
+            if (self.__hasOption(drv, gdal.DMD_CREATIONOPTIONLIST, name) and
+                    not self.__hasOption(
+                        drv, gdal.DS_LAYER_CREATIONOPTIONLIST, name)):
+                datasetOptions.append(option)
+            else:
+                layerOptions.append(option)
+        return datasetOptions, layerOptions
+
+    @staticmethod
+    def __wkbCoordinates(wkb, offset=0):
+        """
+        Walk the little endian ISO WKB geometry starting at offset and
+        return the offset after it and a list of the runs of points in
+        it as (offset, number of points, ordinates per point, ordinates
+        to round). M values are measures so they aren't rounded.
+        """
+        code, = struct.unpack_from('<I', wkb, offset + 1)
+        base, flags = code % 1000, code // 1000
+        dims = (2, 3, 3, 4)[flags]  # XY, XYZ, XYM, XYZM
+        coords = (2, 3, 2, 3)[flags]
+        offset += 5
+        runs = []
+        if base == 1:  # Point
+            runs.append((offset, 1, dims, coords))
+            offset += 8 * dims
+        elif base in (2, 8):  # LineString, CircularString
+            count, = struct.unpack_from('<I', wkb, offset)
+            runs.append((offset + 4, count, dims, coords))
+            offset += 4 + 8 * dims * count
+        elif base in (3, 17):  # Polygon, Triangle
+            rings, = struct.unpack_from('<I', wkb, offset)
+            offset += 4
+            for _ in range(rings):
+                count, = struct.unpack_from('<I', wkb, offset)
+                runs.append((offset + 4, count, dims, coords))
+                offset += 4 + 8 * dims * count
+        else:  # collections of other geometries
+            parts, = struct.unpack_from('<I', wkb, offset)
+            offset += 4
+            for _ in range(parts):
+                offset, partRuns = Interpreter.__wkbCoordinates(wkb, offset)
+                runs += partRuns
+        return offset, runs
+
+    @staticmethod
+    def __roundGeometry(geom, digits):
+        """
+        Return a copy of geom with its coordinates rounded to digits
+        decimal places. The rounding is done by numpy on the geometry's
+        WKB, rather than point by point, so the worker threads don't
+        hold the GIL for long.
+        """
+        wkb = bytearray(geom.ExportToIsoWkb(ogr.wkbNDR))
+        for offset, count, dims, coords in Interpreter.__wkbCoordinates(
+                wkb)[1]:
+            if count:
+                points = np.frombuffer(wkb, '<f8', count * dims, offset)
+                points = points.reshape(count, dims)[:, :coords]
+                np.round(points, digits, out=points)
+        return ogr.CreateGeometryFromWkb(bytes(wkb),
+                                         geom.GetSpatialReference())
+
+    @staticmethod
+    def __reduceGeometry(tolerance, digits, geom):
+        """
+        Return a simplified and/or rounded copy of geom, called from the
+        worker threads during a copy
+        """
+        if geom is None:
+            return None
+        if tolerance is not None:
+            geom = geom.SimplifyPreserveTopology(tolerance)
+        if digits is not None:
+            geom = Interpreter.__roundGeometry(geom, digits)
+        return geom
+
+    def __batches(self, layer):
+        """
+        Yield the features of layer in lists of batch_size
+        """
+        layer.ResetReading()
+        batch = []
+        for feature in layer:
+            batch.append(feature)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def __createLayer(datasource, inlayer, layername, options=None):
+        """
+        Create an empty layer in datasource with the same schema as inlayer
+        """
+        outlayer = datasource.CreateLayer(layername,
+                                          inlayer.GetSpatialRef(),
+                                          inlayer.GetGeomType(),
+                                          options=options or [])
+        layerDefinition = inlayer.GetLayerDefn()
+        for i in range(layerDefinition.GetFieldCount()):
+            outlayer.CreateField(layerDefinition.GetFieldDefn(i))
+        return outlayer
+
+    def __createDataSource(self, filename, options=None):
+        """
+        Create a new datasource, replacing any existing file, using the
+        filename's extension to pick the driver
+        """
+        idx = filename.rfind(".")
+        ext = filename[idx + 1:]
+
+        # look up driver type based on extension
+        driverName = self.drivers.get(ext)
+        if not driverName:
+            raise IOError("Unable to find a driver for file '%s'" % ext)
+
+        drv = ogr.GetDriverByName(driverName)
+        if os.path.exists(filename):
+            drv.DeleteDataSource(filename)
+
+        datasetOptions = self.__creationOptions(drv, options or {})[0]
+        return drv, drv.CreateDataSource(filename, options=datasetOptions)
+
+    def __copyLayer(self, drv, datasource, inlayer, layername, options):
+        """
+        Copy inlayer to datasource as layername. If the options ask for
+        simplification or reduced precision the features are streamed
+        across in batches with the geometries processed in parallel,
+        otherwise OGR copies the layer directly.
+        """
+        tolerance = options.get('simplify')
+        if tolerance is not None:
+            tolerance = float(tolerance)
+        digits = options.get('precision')
+        if digits is not None:
+            digits = int(digits)
+
+        layer_options = self.__creationOptions(drv, options)[1]
+        if (digits is not None and
+                self.__hasOption(drv, gdal.DS_LAYER_CREATIONOPTIONLIST,
+                                 'COORDINATE_PRECISION')):
+            # let the writer handle it
+            layer_options.append('COORDINATE_PRECISION=%d' % digits)
+            digits = None
+
+        if tolerance is None and digits is None:
+            datasource.CopyLayer(inlayer, layername, options=layer_options)
+            return
+
+        outlayer = self.__createLayer(datasource, inlayer, layername,
+                                      layer_options)
+        outDefinition = outlayer.GetLayerDefn()
+
+        reduce_ = partial(self.__reduceGeometry, tolerance, digits)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # while the pool works on one batch the previous one is written
+            # and the next one read
+            pending = None
+            for batch in self.__batches(inlayer):
+                geoms = pool.map(reduce_,
+                                 [f.GetGeometryRef() for f in batch])
+                if pending is not None:
+                    self.__writeBatch(outlayer, outDefinition, *pending)
+                pending = batch, geoms
+            if pending is not None:
+                self.__writeBatch(outlayer, outDefinition, *pending)
+
+    @staticmethod
+    def __writeBatch(outlayer, outDefinition, batch, geoms):
+        """
+        Write a batch of features with their new geometries in one
+        transaction, as CopyLayer does
+        """
+        outlayer.StartTransaction()
+        try:
+            for feature, geom in zip(batch, geoms):
+                # drop the old geometry so that SetFrom only copies the
+                # attributes
+                feature.SetGeometryDirectly(None)
+                outfeature = ogr.Feature(outDefinition)
+                outfeature.SetFrom(feature)
+                if geom is not None:
+                    outfeature.SetGeometryDirectly(geom)
+                outlayer.CreateFeature(outfeature)
+        except Exception:
+            outlayer.RollbackTransaction()
+            raise
+        outlayer.CommitTransaction()
 
     def ogr_copy(self, *args):
+        args, options = self.__getOptions(args)
         infilename = self.__getFileName(args[0])
-        if self.is_var(args[1]):
-            layername = self.__getVar(args[1])
-        else:
-            layername = args[1]
+        layername = self.__value(args[1])
         # arg[2] is "to"
         outfilename = self.__getFileName(args[3])
         if len(args) > 4:
-            if self.is_var(args[4]):
-                outlayername = self.__getVar(args[4])
-            else:
-                outlayername = args[4]
+            outlayername = self.__value(args[4])
         else:
             outlayername = layername
 
@@ -312,22 +769,11 @@ class Interpreter:
         if indataSource is None:
             raise IOError("Could not open %s" % (infilename))
 
-        idx = outfilename.rfind(".")
-        ext = outfilename[idx + 1:]
-
-        # look up driver type based on extension
-        driverName = self.drivers.get(ext)
-        if not driverName:
-            raise IOError("Unable to find a driver for file '%s'" % ext)
-
-        drv = ogr.GetDriverByName(driverName)
-        if os.path.exists(outfilename):
-            drv.DeleteDataSource(outfilename)
-
-        outdatasource = drv.CreateDataSource(outfilename)
+        drv, outdatasource = self.__createDataSource(outfilename, options)
         if outdatasource is not None:
             inlayer = indataSource.GetLayerByName(layername)
-            outdatasource.CopyLayer(inlayer, new_name=outlayername)
+            self.__copyLayer(drv, outdatasource, inlayer, outlayername,
+                             options)
             outdatasource = None  # save!
             return True
         else:
@@ -337,20 +783,20 @@ class Interpreter:
         """
         List the layers in the current datasource
         """
-        if arg:
-            ds = self.__getVar(arg)
+        if arg is not None:
+            ds = arg
         else:
             ds = self.dataSource
 
         count = ds.GetLayerCount()
-        print("%d layers" % count)
+        self.output("%d layers" % count)
         layers = []
         for i in range(count):
             layer = ds.GetLayerByIndex(i)
             layers.append(layer)
         layers = sorted(layers, key=lambda x: x.GetName())
         for layer in layers:
-            print("Name: %s" % layer.GetName())
+            self.output("Name: %s" % layer.GetName())
         if len(layers) == 0:
             return False
         else:
@@ -361,23 +807,20 @@ class Interpreter:
         Get information about the named layer in the current datasource, if
         there is another argument then print the full metadata.
         """
-        try:
-            layername = self.__getVar(args[0])
-        except SyntaxError:
-            layername = args[0].value
+        layername = self.__value(args[0])
         full = False
         if len(args) > 1:
             full = True
         layer = self.dataSource.GetLayerByName(layername)
         if layer:
-            print(layername)
+            self.output(layername)
             featureCount = layer.GetFeatureCount()
-            print("Number of features in  %d" %
-                  (featureCount))
-            print("BBox: (%f %f), (%f %f)" % layer.GetExtent())
+            self.output("Number of features in  %d" %
+                        (featureCount))
+            self.output("BBox: (%f %f), (%f %f)" % layer.GetExtent())
             if full:
                 layerDefinition = layer.GetLayerDefn()
-                print("Name  -  Type  Width  Precision")
+                self.output("Name  -  Type  Width  Precision")
                 for i in range(layerDefinition.GetFieldCount()):
                     fieldName = layerDefinition.GetFieldDefn(i).GetName()
                     fieldTypeCode = layerDefinition.GetFieldDefn(i).GetType()
@@ -387,49 +830,184 @@ class Interpreter:
                     GetPrecision = layerDefinition.GetFieldDefn(
                         i).GetPrecision()
 
-                    print(fieldName + " - " + fieldType + " " + str(fieldWidth)
-                          + " " + str(GetPrecision))
+                    self.output(fieldName + " - " + fieldType + " " +
+                                str(fieldWidth) + " " + str(GetPrecision))
             return True
         else:
-            print("%s not found" % layername)
+            self.output("%s not found" % layername)
+            return False
+
+    def __getLayer(self, arg):
+        """
+        Look up the named layer (or the layer named by a variable) in the
+        current datasource
+        """
+        layername = self.__value(arg)
+        return layername, self.dataSource.GetLayerByName(layername)
+
+    def __printFeature(self, feature):
+        """
+        Print a one line summary of a feature
+        """
+        geom = feature.GetGeometryRef()
+        geomName = geom.GetGeometryName() if geom is not None else None
+        self.output("%d: %s %s" %
+                    (feature.GetFID(), feature.items(), geomName))
+
+    def ogr_head(self, *args):
+        """
+        Print the first n features of the named layer in the current
+        datasource, only n features are read.
+        """
+        layername, layer = self.__getLayer(args[0])
+        if not layer:
+            self.output("%s not found" % layername)
+            return False
+        count = int(args[1]) if len(args) > 1 else self.head_length
+
+        layer.ResetReading()
+        for _ in range(count):
+            feature = layer.GetNextFeature()
+            if feature is None:
+                break
+            self.__printFeature(feature)
+        return True
+
+    def __fidRange(self, layer):
+        """
+        Return the lowest and highest FIDs in layer. Layers with a FID
+        column (e.g. GeoPackages) are asked for them, otherwise the FIDs
+        are assumed to run on from the first feature's.
+        """
+        fidColumn = layer.GetFIDColumn()
+        if fidColumn and self.dataSource is not None:
+            result = self.dataSource.ExecuteSQL(
+                'SELECT MIN("%s"), MAX("%s") FROM "%s"' %
+                (fidColumn, fidColumn, layer.GetName()))
+            try:
+                row = result.GetNextFeature()
+                low, high = row.GetField(0), row.GetField(1)
+            finally:
+                self.dataSource.ReleaseResultSet(result)
+            if low is not None:
+                return int(low), int(high)
+        layer.ResetReading()
+        first = layer.GetNextFeature()
+        if first is None:
+            return 0, -1
+        return first.GetFID(), first.GetFID() + layer.GetFeatureCount() - 1
+
+    @staticmethod
+    def __getFeature(layer, fid):
+        try:
+            return layer.GetFeature(fid)
+        except RuntimeError:  # some drivers complain about missing FIDs
+            return None
+
+    def __sample(self, layer, count):
+        """
+        Pick a reproducible random sample of count features from layer.
+        If the driver can jump to a feature by index, or fetch a feature by
+        FID, quickly just the sampled features are read, otherwise
+        reservoir sampling is used in a single pass over the layer.
+        """
+        rng = random.Random(self.sample_seed)
+        features = []
+        fastCount = layer.TestCapability(ogr.OLCFastFeatureCount)
+        if fastCount and layer.TestCapability(ogr.OLCFastSetNextByIndex):
+            total = layer.GetFeatureCount()
+            for idx in sorted(rng.sample(range(total), min(count, total))):
+                layer.SetNextByIndex(idx)
+                features.append(layer.GetNextFeature())
+        elif fastCount and layer.TestCapability(ogr.OLCRandomRead):
+            target = min(count, layer.GetFeatureCount())
+            low, high = self.__fidRange(layer)
+            tried = set()
+            # draw again when there is no feature with the FID
+            while len(features) < target and len(tried) <= high - low:
+                fid = rng.randint(low, high)
+                if fid in tried:
+                    continue
+                tried.add(fid)
+                feature = self.__getFeature(layer, fid)
+                if feature is not None:
+                    features.append(feature)
+            features.sort(key=lambda f: f.GetFID())
+        else:
+            layer.ResetReading()
+            for i, feature in enumerate(layer):
+                if i < count:
+                    features.append(feature)
+                else:
+                    j = rng.randint(0, i)
+                    if j < count:
+                        features[j] = feature
+        return features
+
+    def ogr_sample(self, *args):
+        """
+        Take a random sample of n features from the named layer in the
+        current datasource and print them, or if a file is given, save
+        them to it.
+        """
+        layername, layer = self.__getLayer(args[0])
+        if not layer:
+            self.output("%s not found" % layername)
             return False
+        features = self.__sample(layer, int(args[1]))
+
+        if len(args) > 2:
+            # arg[2] is "to"
+            filename = self.__getFileName(args[3])
+            drv, datasource = self.__createDataSource(filename)
+            if datasource is None:
+                self.output("unable to save to %s" % filename)
+                return False
+            outlayer = self.__createLayer(datasource, layer, layername)
+            outDefinition = outlayer.GetLayerDefn()
+            for feature in features:
+                outfeature = ogr.Feature(outDefinition)
+                outfeature.SetFrom(feature)
+                outlayer.CreateFeature(outfeature)
+            datasource = None  # save!
+        else:
+            for feature in features:
+                self.__printFeature(feature)
+        return True
 
-    def ogr_save(self, fname, lname=None):
+    def ogr_save(self, *args):
         """
         Save the named layer of the current layer in the file
         """
+        args, options = self.__getOptions(args)
+        fname = args[0]
+        lname = args[1] if len(args) > 1 else None
         filename = self.__getFileName(fname)
         idx = filename.rfind(".")
-        ext = filename[idx + 1:]
         if lname:
             layername = lname
         else:
             layername = filename[:idx]
 
-        # look up driver type based on extension
-        driverName = self.drivers.get(ext)
-        if not driverName:
-            print("Unable to find a driver for file '%s'" % ext)
+        try:
+            drv, datasource = self.__createDataSource(filename, options)
+        except IOError as e:
+            self.output(e)
             return
-        drv = ogr.GetDriverByName(driverName)
-        if os.path.exists(filename):
-            drv.DeleteDataSource(filename)
-
-        datasource = drv.CreateDataSource(filename)
         if datasource is not None:
             inlayer = self.dataSource.GetLayerByName(layername)
-            datasource.CopyLayer(inlayer, new_name=layername)
+            self.__copyLayer(drv, datasource, inlayer, layername, options)
             datasource = None  # save!
             return True
         else:
-            print("unable to save to %s" % filename)
+            self.output("unable to save to %s" % filename)
             return False
 
     def run(self, program):
         """
         parse & run the command(s) in the program
         """
-        parse_tree = self.parser.parse(program)
+        parse_tree = self.parse(program)
         # print(parse_tree.pretty())
         res = False
         for inst in parse_tree.children:
@@ -1,13 +1,19 @@
 !start      : command+ 
 
 !command    : (VARIABLE "=")? "list" [VARIABLE]
-            | "copy" ATOM ATOM "to" ATOM [ATOM]
-            | "save" ATOM [ATOM]
+            | "copy" ATOM ATOM "to" ATOM [ATOM] copy_option*
+            | "save" ATOM [ATOM] copy_option*
             | (VARIABLE "=" ATOM )
             | (VARIABLE "=")? "open" ATOM
             | "info" ATOM+
+            | "head" ATOM [INTEGER]
+            | "sample" ATOM INTEGER ["to" ATOM]
             | "print" VARIABLE
             | "history"
+            | "set" ATOM [ATOM|NUMBER]
+            | "set" ATOM (ATOM|NUMBER) code_block -> set_block
+            | "close" [VARIABLE]
+            | "memory"
             | "!" INTEGER -> exec
             | "!!"        -> repeat_hist
             | "for" VARIABLE "in" LIST code_block -> for
@@ -16,15 +22,20 @@ ATOM        : VARIABLE
             | FILENAME
             | CNAME
             | ("\""|"'")? CNAME ("\""|"'")?
+copy_option : "simplify" NUMBER -> simplify
+            | "precision" INTEGER -> precision
+            | "with" "options" "{" OPTION ("," OPTION)* "}" -> with_options
 code_block  : "{"  (command)+  "}"
 LIST        : "[" ATOM ("," ATOM)+  "]" | GLOB
 GLOB        : (LETTER|DIGIT|"*"|"/"|".")+ 
 VARIABLE    : (LETTER)("_"|LETTER|DIGIT)*
 FILENAME    : ("\""|"'")? NAME "." EXTENSION ("\""|"'")? 
 EXTENSION   : "shp"|"gpkg"|"geojson"|"json"
+OPTION      : CNAME "=" /[^\s,{}]+/
 NAME        : ["/"|"./"|"../"]? (CNAME ["/"])+
 
 %import common.INT -> INTEGER
+%import common.NUMBER
 %import common.LETTER
 %import common.DIGIT
 %import common.CNAME
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import threading
+import pytest
+from osgeo import gdal
+from shetland.async_interpreter import AsyncInterpreter
+from shetland.interpreter import Interpreter
+
+
+class TestAsyncInterpreter:
+
+    THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+    def setup_method(self, method):
+        self.interpreter = AsyncInterpreter(max_workers=2)
+        self.data_path = os.path.normpath(
+            os.path.join(self.THIS_DIR, os.pardir, 'tests/data/'))
+
+    def teardown_method(self, method):
+        self.interpreter.shutdown()
+
+    async def collect(self, program):
+        return [item async for item in self.interpreter.run(program)]
+
+    def test_run(self):
+        code = """a = open '%s/states.shp'
+        print a
+        list a"""
+        items = asyncio.run(self.collect(code % self.data_path))
+        results = [v for k, v in items if k == "result"]
+        assert results == [True, True, ['states']]
+        assert ("print", "Name: states") in items
+
+    def test_result_handle_open(self):
+        code = "open '%s/states.shp'" % self.data_path
+        items = asyncio.run(self.collect(code))
+        ds = [v for k, v in items if k == "result"][0]
+        # the script has finished but the datasource is still usable
+        assert ds.GetLayerCount() == 1
+        assert ds.GetLayer(0).GetFeatureCount() > 0
+
+    def test_isolated(self):
+        async def run():
+            return await asyncio.gather(
+                self.collect("a=/tmp/one.shp\nprint a"),
+                self.collect("a=/tmp/two.shp\nprint a"))
+        one, two = asyncio.run(run())
+        assert ("print", "/tmp/one.shp") in one
+        assert ("print", "/tmp/two.shp") in two
+
+    def test_isolated_options(self, monkeypatch):
+        # make both scripts set their option before either reads it back
+        barrier = threading.Barrier(2, timeout=10)
+        set_option = Interpreter.set_option
+
+        def set_and_wait(interpreter, name, value=None):
+            res = set_option(interpreter, name, value)
+            if value is not None:
+                barrier.wait()
+            return res
+        monkeypatch.setattr(Interpreter, "set_option", set_and_wait)
+
+        threads = gdal.GetConfigOption("GDAL_NUM_THREADS")
+
+        async def run():
+            return await asyncio.gather(
+                self.collect("set threads 1\nset threads"),
+                self.collect("set threads 3\nset threads"))
+        one, two = asyncio.run(run())
+        assert ("print", "GDAL_NUM_THREADS=1") in one
+        assert ("print", "GDAL_NUM_THREADS=3") in two
+        assert gdal.GetConfigOption("GDAL_NUM_THREADS") == threads
+
+    def test_no_cache_or_history(self):
+        for code in ("set cache 64", "history", "!!"):
+            with pytest.raises(SyntaxError):
+                asyncio.run(self.collect(code))
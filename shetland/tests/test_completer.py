@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+from shetland.completer import Completer, Trie
+
+
+class TestCompleter:
+
+    def setup_method(self, method):
+        self.completer = Completer(["open", "save", "sample", "list"])
+        self.out_path = os.path.normpath(tempfile.mkdtemp(
+            prefix="shetland"))
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.out_path)
+
+    def matches(self, prefix):
+        words = []
+        while True:
+            word = self.completer.complete(prefix, len(words))
+            if word is None:
+                return words
+            words.append(word)
+
+    def test_trie(self):
+        trie = Trie(["states", "state", "stations"])
+        assert trie.startswith("stat") == ["state", "states", "stations"]
+        assert trie.startswith("x") == []
+        trie.add("state")
+        trie.remove("state")
+        assert "state" in trie
+        trie.remove("state")
+        assert "state" not in trie
+        assert trie.startswith("sta") == ["states", "stations"]
+
+    def test_keywords(self):
+        assert self.matches("sa") == ["sample", "save"]
+        assert self.matches("zz") == []
+
+    def test_variables(self):
+        self.completer.add_word("sam")
+        assert self.matches("sa") == ["sam", "sample", "save"]
+        self.completer.remove_word("sam")
+        assert self.matches("sa") == ["sample", "save"]
+
+    def test_layers(self):
+        calls = []
+
+        def names():
+            calls.append(1)
+            return ["states", "lakes"]
+
+        filename = os.path.join(self.out_path, "x.gpkg")
+        open(filename, "w").close()
+        self.completer.add_source(filename, names)
+        assert self.matches("st") == ["states"]
+        self.completer.remove_source(filename)
+        assert self.matches("st") == []
+        # the layer names are cached while the file is unchanged
+        self.completer.add_source(filename, names)
+        assert self.matches("la") == ["lakes"]
+        assert len(calls) == 1
+
+    def test_paths(self):
+        os.mkdir(os.path.join(self.out_path, "data"))
+        open(os.path.join(self.out_path, "states.shp"), "w").close()
+        prefix = self.out_path + os.sep
+        assert self.matches(prefix + "s") == [prefix + "states.shp"]
+        assert self.matches(prefix + "d") == [prefix + "data/"]
+        # new files are seen once the directory has changed
+        self.completer.cache_timeout = 0
+        open(os.path.join(self.out_path, "stations.shp"), "w").close()
+        assert self.matches(prefix + "st") == [prefix + "states.shp",
+                                               prefix + "stations.shp"]
@@ -2,8 +2,10 @@ import pytest
 import tempfile
 import os
 import shutil
+import sqlite3
 from shetland.interpreter import Interpreter
 import lark
+from osgeo import gdal, ogr
 
 
 class TestInterpreter:
@@ -136,3 +138,222 @@ class TestInterpreter:
         info copy1 full
         """
         assert self.run(code % (self.out_path)) is True
+
+    @staticmethod
+    def points(geom):
+        """
+        Return all the coordinates of a geometry and its parts
+        """
+        coords = list(geom.GetPoints() or [])
+        for i in range(geom.GetGeometryCount()):
+            coords += TestInterpreter.points(geom.GetGeometryRef(i))
+        return coords
+
+    def layer_points(self, filename):
+        ds = ogr.Open(filename)
+        layer = ds.GetLayer(0)
+        return [c for f in layer for c in self.points(f.GetGeometryRef())]
+
+    def test_copy_simplify(self):
+        code = ("copy %s/states.shp states to %s/simple.geojson "
+                "simplify 0.1 precision 3")
+        assert self.run(code % (self.data_path, self.out_path)) is True
+        source = self.layer_points("%s/states.shp" % self.data_path)
+        coords = self.layer_points("%s/simple.geojson" % self.out_path)
+        assert 0 < len(coords) < len(source)
+        # the GeoJSON writer's COORDINATE_PRECISION does the rounding
+        assert all(round(v, 3) == v for c in coords for v in c)
+
+    def test_save_precision(self):
+        code = """open '%s/states.shp'
+            save '%s/ian.gpkg' states precision 2
+            """
+        assert self.run(code % (self.data_path, self.out_path)) is True
+        source = self.layer_points("%s/states.shp" % self.data_path)
+        coords = self.layer_points("%s/ian.gpkg" % self.out_path)
+        # GeoPackages have no precision option so the copy rounds them
+        assert len(coords) == len(source)
+        assert all(round(v, 2) == v for c in coords for v in c)
+        assert any(round(v, 2) != v for c in source for v in c)
+
+    def test_precision_keeps_m(self):
+        filename = "%s/measured.gpkg" % self.out_path
+        ds = ogr.GetDriverByName("GPKG").CreateDataSource(filename)
+        layer = ds.CreateLayer("measured", geom_type=ogr.wkbLineStringM)
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(ogr.CreateGeometryFromWkt(
+            "LINESTRING M (1.234 5.678 9.876, 2.345 6.789 8.765)"))
+        layer.CreateFeature(feature)
+        ds = None
+        code = "copy %s measured to %s/rounded.gpkg precision 1"
+        assert self.run(code % (filename, self.out_path)) is True
+        ds = ogr.Open("%s/rounded.gpkg" % self.out_path)
+        geom = ds.GetLayer(0).GetNextFeature().GetGeometryRef()
+        assert geom.ExportToIsoWkt() == \
+            "LINESTRING M (1.2 5.7 9.876,2.3 6.8 8.765)"
+
+    def features(self, code):
+        """
+        Run code and return the FIDs of the features it prints
+        """
+        lines = []
+        self.interpreter.output = lines.append
+        assert self.run(code) is True
+        fids = [line.split(":")[0] for line in lines]
+        return [int(fid) for fid in fids if fid.isdigit()]
+
+    def test_head(self):
+        code = """open '%s/states.%s'
+        head states 3"""
+        for ext in self.drivers.keys():
+            fids = self.features(code % (self.data_path, ext))
+            assert len(fids) == 3
+
+    def check_sample(self, ext):
+        code = """open '%s/states.%s'
+        sample states 5""" % (self.data_path, ext)
+        fids = self.features(code)
+        assert len(fids) == 5
+        assert len(set(fids)) == 5
+        assert self.features(code) == fids
+
+    def test_sample(self):
+        for ext in ("shp", "geojson", "gpkg"):
+            self.check_sample(ext)
+
+    def test_sample_get_feature(self, monkeypatch):
+        # a capability no layer has, so features are fetched by FID
+        monkeypatch.setattr(ogr, "OLCFastSetNextByIndex", "NoSuchCapability")
+        for ext in ("shp", "gpkg"):
+            self.check_sample(ext)
+
+    def test_sample_reservoir(self, monkeypatch):
+        # capabilities no layer has, so the layer is read in one pass
+        monkeypatch.setattr(ogr, "OLCFastSetNextByIndex", "NoSuchCapability")
+        monkeypatch.setattr(ogr, "OLCRandomRead", "NoSuchCapability")
+        for ext in ("shp", "geojson", "gpkg"):
+            self.check_sample(ext)
+
+    def test_sample_to_file(self):
+        code = """open '%s/states.%s'
+        sample states 5 to %s/sample.shp"""
+        for ext in ("shp", "geojson"):
+            names = []
+            for _ in range(2):
+                self.run(code % (self.data_path, ext, self.out_path))
+                ds = ogr.Open("%s/sample.shp" % self.out_path)
+                layer = ds.GetLayer(0)
+                assert layer.GetFeatureCount() == 5
+                names.append([f.GetField("STATE_NAME") for f in layer])
+                ds = None
+            assert names[0] == names[1]
+
+    def test_vars_per_instance(self):
+        self.run("a=/tmp/ian.shp")
+        assert 'a' not in Interpreter().vars
+
+    def test_for_loop_scope(self):
+        code = """for i in ["x","y"] {
+            a = open '%s/states.shp'
+        }"""
+        assert self.run(code % self.data_path) is True
+        assert 'a' not in self.interpreter.vars
+        assert 'i' not in self.interpreter.vars
+
+    def test_reopen_keeps_returned_handle(self):
+        ds = self.run("open '%s/states.shp'" % self.data_path)
+        self.run("open '%s/states.gpkg'" % self.data_path)
+        self.interpreter.close()
+        assert ds.GetLayerCount() == 1
+        assert ds.GetLayer(0).GetFeatureCount() > 0
+
+    def test_close(self):
+        code = """a = open '%s/states.shp'
+        b = open '%s/states.gpkg'
+        close a
+        memory
+        list b"""
+        assert self.run(code % (self.data_path, self.data_path))
+        assert 'a' not in self.interpreter.vars
+        with pytest.raises(SyntaxError):
+            self.run("close a")
+
+    def test_close_current(self):
+        code = """open '%s/states.shp'
+        close"""
+        assert self.run(code % self.data_path) is True
+        assert self.interpreter.dataSource is None
+
+    def test_set(self):
+        threads = gdal.GetConfigOption("GDAL_NUM_THREADS")
+        cache = gdal.GetCacheMax()
+        try:
+            assert self.run("set threads 2") is True
+            assert gdal.GetConfigOption("GDAL_NUM_THREADS") == "2"
+            assert self.run("set cache 64") is True
+            assert gdal.GetCacheMax() == 64 * 1024 * 1024
+            assert self.run("set cache 1.5") is True
+            assert gdal.GetCacheMax() == int(1.5 * 1024 * 1024)
+            with pytest.raises(SyntaxError):
+                self.run("set cache big")
+        finally:
+            gdal.SetConfigOption("GDAL_NUM_THREADS", threads)
+            gdal.SetCacheMax(cache)
+
+    def test_set_block(self):
+        code = """set sync OFF {
+            copy %s/states.shp states to %s/scratch.gpkg
+            set sync
+        }"""
+        lines = []
+        self.interpreter.output = lines.append
+        before = gdal.GetConfigOption("OGR_SQLITE_SYNCHRONOUS")
+        assert self.run(code % (self.data_path, self.out_path)) is True
+        assert "OGR_SQLITE_SYNCHRONOUS=OFF" in lines
+        assert gdal.GetConfigOption("OGR_SQLITE_SYNCHRONOUS") == before
+
+    @staticmethod
+    def gpkg_info(filename):
+        """
+        Return the user_version and the names of the tables of a GeoPackage
+        """
+        with sqlite3.connect(filename) as db:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            tables = [r[0] for r in db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")]
+        return version, tables
+
+    def test_copy_with_options(self):
+        code = "copy %s/states.shp states to %s/default.gpkg"
+        assert self.run(code % (self.data_path, self.out_path)) is True
+        version, tables = self.gpkg_info("%s/default.gpkg" % self.out_path)
+        assert any(t.startswith("rtree_") for t in tables)
+
+        code = ("copy %s/states.shp states to %s/options.gpkg "
+                "with options {SPATIAL_INDEX=NO, VERSION=1.2}")
+        assert self.run(code % (self.data_path, self.out_path)) is True
+        version, tables = self.gpkg_info("%s/options.gpkg" % self.out_path)
+        # VERSION is a dataset option and SPATIAL_INDEX a layer option
+        assert version == 10200
+        assert not any(t.startswith("rtree_") for t in tables)
+
+    def test_parse_cache(self):
+        code = """open '%s/states.shp'
+        info states""" % self.data_path
+        assert self.run(code) is True
+        hits = self.interpreter.parse.cache_info().hits
+        assert self.run(code) is True
+        assert self.interpreter.parse.cache_info().hits == hits + 1
+
+    def test_rebind_cached(self):
+        code = """open a
+        info states"""
+        for ext in self.drivers.keys():
+            self.run("a=%s/states.%s" % (self.data_path, ext))
+            assert self.run(code) is True
+
+    def test_for_loop_open(self):
+        code = """for i in %s/states.shp {
+            open i
+        }"""
+        assert self.run(code % self.data_path)